@@ -4,7 +4,7 @@ IFX MSD GenAI Tool - Flask Application
 AI-powered log analysis for MSD cases
 """
 
-from flask import Flask, render_template, request, redirect, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, session, flash, jsonify, send_file, abort
 import markdown
 import logs_analysis_genai
 import os
@@ -12,6 +12,9 @@ import logging
 import tempfile
 from werkzeug.utils import secure_filename
 import test
+from log_store import LogStore, merge_timelines, render_timeline, fit_budget
+from result_archive import ResultArchive
+from profiling import JobProfiler, profile_section, profiling_requested, is_admin, PROFILE_FILE, REPORT_FILE
 from datetime import datetime
 import uuid
 import threading
@@ -31,8 +34,20 @@ app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()  # Use system temp directory
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'log', 'txt', 'md', 'dmesg'}
 
+# Input size sent to the model per analysis (characters)
+MAX_ANALYSIS_CHARS = 20000
+
 # In-memory job storage
 jobs = {}
+
+# Uploaded logs are kept on disk so a time window can be re-analyzed without re-uploading
+log_store = LogStore(os.path.join(app.config['UPLOAD_FOLDER'], 'wifi_logs_store'))
+
+# Finished analyses are archived as compressed Markdown, indexed by job id
+result_archive = ResultArchive(os.path.join(app.config['UPLOAD_FOLDER'], 'wifi_logs_archive', 'results.db'))
+
+# Opt-in job profiles (see profiling.py), downloadable by admins
+PROFILE_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'wifi_logs_profiles')
   
 # To render a Index Page 
 @app.route('/')
@@ -56,38 +71,39 @@ def handle_post():
         
         logger.info(f'Processing MSD URL: {msdcaseurl}')
         
+        profiler = request_profiler()
+        job_id = profiler.job_id if profiler else str(uuid.uuid4())
+        
         # Run analysis
-        analysis = logs_analysis_genai.run_analysis(msdcaseurl)
+        with profile_section(profiler, 'run_analysis'):
+            markdown_content = logs_analysis_genai.run_analysis(msdcaseurl)
+        profile_url = save_job_profile(job_id, profiler)
         
-        # Read the analysis results
-        try:
-            with open('response.md', 'r', encoding='utf-8') as f:
-                markdown_content = f.read()
-            
-            # Backup the response to temp directory
-            try:
-                response_file = os.path.join(tempfile.gettempdir(), f'response_{datetime.now().strftime("%Y%m%d_%H%M%S")}.md')
-                with open(response_file, 'w', encoding='utf-8') as f:
-                    f.write(markdown_content)
-                logger.info(f'Response saved to: {response_file}')
-            except:
-                logger.warning('Could not save response file - continuing without saving')
-                
-        except FileNotFoundError:
-            logger.error('Response file not found')
+        if not markdown_content:
+            logger.error('MSD analysis returned no results')
             return render_template('results.html', 
-                                 analysis_html='<p>Analysis completed but results file not found.</p>',
+                                 analysis_html='<p>Analysis completed but returned no results.</p>',
                                  analysis_type='Error',
-                                 timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                                 timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                 job_id=job_id,
+                                 profile_url=profile_url)
         
-        # Convert to HTML
-        html_content = markdown.markdown(markdown_content, extensions=['tables', 'fenced_code'])
+        # Archive the response under its own job id
+        try:
+            result_archive.save(job_id, markdown_content, 'MSD', msdcaseurl)
+            html_content = result_archive.get_html(job_id)
+            logger.info(f'Response archived as job {job_id}')
+        except Exception as e:
+            logger.warning(f'Could not archive response - continuing without saving: {str(e)}')
+            html_content = markdown.markdown(markdown_content, extensions=['tables', 'fenced_code'])
         
         logger.info('MSD analysis completed successfully')
         return render_template('results.html', 
                              analysis_html=html_content,
                              analysis_type='MSD Case Analysis',
-                             timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                             timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                             job_id=job_id,
+                             profile_url=profile_url)
         
     except Exception as e:
         logger.error(f'Error in MSD analysis: {str(e)}')
@@ -126,10 +142,18 @@ def handle_log_upload(log_type):
                                  timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
         
         filename = secure_filename(file.filename)
-        file_content = file.read().decode('utf-8', errors='ignore')
+        profiler = request_profiler()
+        with profile_section(profiler, 'read_upload'):
+            file_data = file.read()
+        with profile_section(profiler, 'decode'):
+            file_content = file_data.decode('utf-8', errors='ignore')
+        
+        # Store the raw log once so later window re-runs can slice it
+        with profile_section(profiler, 'log_store.save'):
+            log_id = log_store.save(file_data)
         
         # Start async analysis with log type
-        job_id = start_analysis_job(filename, file_content, log_type)
+        job_id = start_analysis_job(filename, file_content, log_type, log_id, profiler)
         
         # Return processing page with job ID
         return render_template('processing.html', job_id=job_id, filename=filename)
@@ -141,35 +165,137 @@ def handle_log_upload(log_type):
                              analysis_type='Error',
                              timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
+# Handle several WiFi/BT logs merged into one correlated analysis
+@app.route('/handle_multi_upload', methods=['POST'])
+def handle_multi_upload():
+    logger.info('Multi-file log upload request received')
+    try:
+        files = [f for f in request.files.getlist('logfiles') if f.filename != '']
+        if not files:
+            logger.warning('No files in request')
+            return render_template('results.html', 
+                                 analysis_html='<p>No files were selected for upload.</p>',
+                                 analysis_type='Error',
+                                 timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        
+        invalid = [f.filename for f in files if not allowed_file(f.filename)]
+        if invalid:
+            logger.warning(f'Invalid files: {invalid}')
+            return render_template('results.html', 
+                                 analysis_html='<p>Please select valid log files (.log, .txt, .md, .dmesg).</p>',
+                                 analysis_type='Error',
+                                 timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        
+        # Optional per-file clock offsets in seconds, in upload order
+        offsets_field = request.form.get('offsets', '').strip()
+        try:
+            offsets = [float(value.strip() or 0) for value in offsets_field.split(',')] if offsets_field else None
+        except ValueError:
+            offsets = []
+        if offsets is not None and len(offsets) != len(files):
+            return render_template('results.html', 
+                                 analysis_html=f'<p>Please provide one numeric clock offset per file ({len(files)} files).</p>',
+                                 analysis_type='Error',
+                                 timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        
+        # Merge into one deduplicated timeline so a single model call sees all sources
+        profiler = request_profiler()
+        with profile_section(profiler, 'read_upload'):
+            sources = [(secure_filename(f.filename), f.read()) for f in files]
+        try:
+            with profile_section(profiler, 'merge_timelines'):
+                entries = merge_timelines(sources, offsets)
+        except ValueError as e:
+            logger.warning(f'Cannot merge logs: {str(e)}')
+            return render_template('results.html', 
+                                 analysis_html=f'<p>{str(e)}.</p>',
+                                 analysis_type='Error',
+                                 timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        
+        with profile_section(profiler, 'render_timeline'):
+            merged_data = render_timeline(entries)
+        
+        # The model input is budgeted per source so no log crowds out the others
+        with profile_section(profiler, 'fit_budget'):
+            file_content = render_timeline(fit_budget(entries, MAX_ANALYSIS_CHARS)).decode('utf-8', errors='ignore')
+        filename = ', '.join(name for name, _ in sources)
+        
+        with profile_section(profiler, 'log_store.save'):
+            log_id = log_store.save(merged_data)
+        job_id = start_analysis_job(filename, file_content, 'Correlated', log_id, profiler)
+        
+        return render_template('processing.html', job_id=job_id, filename=filename)
+        
+    except Exception as e:
+        logger.error(f'Error in multi-file log upload: {str(e)}')
+        return render_template('results.html', 
+                             analysis_html=f'<p>Error analyzing log files: {str(e)}</p>',
+                             analysis_type='Error',
+                             timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
 # Keep the old route for backward compatibility
 @app.route('/handle_file_upload', methods=['POST'])
 def handle_file_upload():
     return handle_log_upload('WiFi')  # Default to WiFi for backward compatibility
 
-def start_analysis_job(filename, file_content, log_type='WiFi'):
-    job_id = str(uuid.uuid4())
+# Profiler for the job a request starts, or None; request-thread steps are profiled with it
+def request_profiler():
+    if not profiling_requested(request):
+        return None
+    return JobProfiler(str(uuid.uuid4()), PROFILE_FOLDER)
+
+def start_analysis_job(filename, file_content, log_type='WiFi', log_id=None, profiler=None):
+    # A profiled job takes its id from the profiler that already covers the upload
+    job_id = profiler.job_id if profiler else str(uuid.uuid4())
     jobs[job_id] = {
         "status": "processing", 
         "result": None, 
         "filename": filename,
         "log_type": log_type,
+        "log_id": log_id,
         "started": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
     
     # Start background processing
-    thread = threading.Thread(target=process_analysis, args=(job_id, filename, file_content, log_type))
+    thread = threading.Thread(target=process_analysis, args=(job_id, filename, file_content, log_type, log_id, profiler))
     thread.daemon = True
     thread.start()
     
     return job_id
 
-def process_analysis(job_id, filename, file_content, log_type='WiFi'):
+def process_analysis(job_id, filename, file_content, log_type='WiFi', log_id=None, profiler=None):
+    # Profiling is opt-in; without a profiler the sections below are no-op contexts
+    with profile_section(profiler, 'process_analysis'):
+        job = analyze_log(job_id, filename, file_content, log_type, log_id, profiler)
+    
+    # Save the profile before publishing the final state, so the results page has the link
+    profile_url = save_job_profile(job_id, profiler)
+    if profile_url:
+        job["profile"] = profile_url
+    jobs[job_id] = job
+
+# Returns the profile download link, or None when no profile was saved
+def save_job_profile(job_id, profiler):
+    if not profiler:
+        return None
+    try:
+        if not profiler.save():
+            return None
+        profile_url = f'/profile/{job_id}'
+        logger.info(f'Profile saved for job {job_id}')
+        return profile_url
+    except Exception as e:
+        logger.warning(f'Could not save profile for job {job_id}: {str(e)}')
+        return None
+
+# Runs the analysis and returns the job's final state
+def analyze_log(job_id, filename, file_content, log_type='WiFi', log_id=None, profiler=None):
     try:
         logger.info(f'Starting background {log_type} analysis for job {job_id}')
         
         # Limit input size
-        if len(file_content) > 20000:
-            file_content = file_content[-20000:]
+        if len(file_content) > MAX_ANALYSIS_CHARS:
+            file_content = file_content[-MAX_ANALYSIS_CHARS:]
         
         # Prepare different prompts based on log type
         if log_type == 'WiFi':
@@ -193,6 +319,18 @@ Temporary version rollback
 6. Output answer in this format:
 Root Cause Analysis
 Recommended Tests
+Potential Workarounds'''
+        elif log_type == 'Correlated':
+            test_prompt = '''\n\nThe log above merges several WiFi and Bluetooth logs from the same combo chip into one timeline ordered by aligned timestamp. Each entry starts with its aligned time in seconds in brackets, and each line is prefixed with its source file name followed by "|". The original timestamp of the line follows the prefix.
+task:
+1. Correlate events across the sources (e.g. a WiFi disconnect, scan or channel switch near a BT connection drop, A2DP glitch or HCI error).
+2. Identify WiFi/BT coexistence issues such as antenna sharing conflicts, BT time slots starving WiFi traffic, or firmware traps seen in both logs.
+3. Diagnose the most likely root cause(s) in plain language, citing the source and timestamp of the key lines.
+4. Suggest diagnostic tests and practical workarounds.
+5. Output answer in this format:
+Correlated Timeline Summary
+Root Cause Analysis
+Recommended Tests
 Potential Workarounds'''
         else:
             test_prompt = '\nAnalyze this log file and provide key issues and recommendations.'
@@ -200,28 +338,41 @@ Potential Workarounds'''
         analysis_input = file_content + test_prompt
         
         # Get AI analysis
-        output = test.test_chat_completion_api(analysis_input)
+        with profile_section(profiler, 'test_chat_completion_api'):
+            output = test.test_chat_completion_api(analysis_input)
         
-        # Convert to HTML
-        html_content = markdown.markdown(output, extensions=['tables', 'fenced_code'])
+        # Archive the Markdown; HTML is rendered on first view
+        # If archiving fails, keep the Markdown on the job so the result is not lost
+        content_hash = None
+        markdown_content = None
+        try:
+            with profile_section(profiler, 'result_archive.save'):
+                content_hash = result_archive.save(job_id, output, log_type, filename, log_id)
+        except Exception as e:
+            logger.warning(f'Could not archive result for job {job_id} - keeping it in memory: {str(e)}')
+            markdown_content = output
         
-        jobs[job_id] = {
+        logger.info(f'{log_type} analysis completed for job {job_id}')
+        
+        return {
             "status": "complete", 
-            "result": html_content, 
+            "result": None, 
+            "content_hash": content_hash,
+            "markdown": markdown_content,
             "filename": filename,
             "log_type": log_type,
+            "log_id": log_id,
             "completed": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
         
-        logger.info(f'{log_type} analysis completed for job {job_id}')
-        
     except Exception as e:
         logger.error(f'{log_type} analysis failed for job {job_id}: {str(e)}')
-        jobs[job_id] = {
+        return {
             "status": "error", 
             "result": f"{log_type} analysis failed: {str(e)}", 
             "filename": filename,
             "log_type": log_type,
+            "log_id": log_id,
             "error": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
 
@@ -234,6 +385,20 @@ def job_status(job_id):
 def view_results(job_id):
     job = jobs.get(job_id)
     if not job:
+        # Fall back to the archive for jobs from before a restart or MSD analyses
+        try:
+            archived = result_archive.get(job_id)
+            html_content = result_archive.get_html(job_id) if archived else None
+        except Exception as e:
+            logger.error(f'Could not load archived result for job {job_id}: {str(e)}')
+            return result_unavailable()
+        if html_content is not None:
+            return render_template('results.html', 
+                                 analysis_html=html_content,
+                                 analysis_type=f'{archived["log_type"]} Log Analysis ({archived["filename"]})',
+                                 timestamp=archived['created'],
+                                 job_id=job_id,
+                                 time_ranges=stored_time_ranges(archived.get('log_id')))
         return render_template('results.html', 
                              analysis_html='<p>Job not found.</p>',
                              analysis_type='Error',
@@ -241,16 +406,127 @@ def view_results(job_id):
     
     if job['status'] == 'complete':
         log_type = job.get('log_type', 'Log')
+        time_ranges = stored_time_ranges(job.get('log_id'))
+        if job.get('markdown') is not None:
+            html_content = markdown.markdown(job['markdown'], extensions=['tables', 'fenced_code'])
+        else:
+            try:
+                html_content = result_archive.get_html(job_id)
+            except Exception as e:
+                logger.error(f'Could not load archived result for job {job_id}: {str(e)}')
+                html_content = None
+            if html_content is None:
+                return result_unavailable()
         return render_template('results.html', 
-                             analysis_html=job['result'],
+                             analysis_html=html_content,
                              analysis_type=f'{log_type} Log Analysis ({job["filename"]})',
-                             timestamp=job.get('completed', 'Unknown'))
+                             timestamp=job.get('completed', 'Unknown'),
+                             job_id=job_id,
+                             time_ranges=time_ranges,
+                             profile_url=job.get('profile'))
     else:
         return render_template('results.html', 
                              analysis_html=f'<p>Analysis {job["status"]}: {job.get("result", "Please wait...")}</p>',
                              analysis_type='Status',
                              timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
+def result_unavailable():
+    return render_template('results.html', 
+                         analysis_html='<p>The analysis result could not be loaded. Please try again later.</p>',
+                         analysis_type='Error',
+                         timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+# Page through archived results, newest first (admins only, filenames include case URLs)
+@app.route('/history')
+def history():
+    if not is_admin(request):
+        abort(403)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    log_type = request.args.get('log_type', '').strip() or None
+    query = request.args.get('q', '').strip() or None
+    return jsonify(result_archive.history(page, per_page, log_type, query))
+
+# Download a job profile: text report by default, ?format=prof for the pstats file
+@app.route('/profile/<job_id>')
+def download_profile(job_id):
+    if not is_admin(request):
+        abort(403)
+    try:
+        job_id = str(uuid.UUID(job_id))
+    except ValueError:
+        abort(404)
+    
+    if request.args.get('format') == 'prof':
+        path, mimetype = os.path.join(PROFILE_FOLDER, job_id, PROFILE_FILE), 'application/octet-stream'
+    else:
+        path, mimetype = os.path.join(PROFILE_FOLDER, job_id, REPORT_FILE), 'text/plain'
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype=mimetype, as_attachment=True,
+                     download_name=f'profile_{job_id}_{os.path.basename(path)}')
+
+# Re-run analysis on a time window of an already uploaded log
+@app.route('/reanalyze/<job_id>', methods=['POST'])
+def reanalyze_window(job_id):
+    # Jobs from before a restart are looked up in the archive
+    job = jobs.get(job_id) or result_archive.get(job_id)
+    log_id = job.get('log_id') if job else None
+    if not log_id or not log_store.has(log_id):
+        return log_unavailable()
+    
+    try:
+        # Either "center ± radius" or an explicit start/end range, in log seconds
+        center = request.form.get('center', '').strip()
+        if center:
+            radius = float(request.form.get('radius', '').strip() or 5)
+            start, end = float(center) - radius, float(center) + radius
+        else:
+            start = float(request.form.get('start', '').strip())
+            end = float(request.form.get('end', '').strip())
+        # Logs with clock resets (reboots) have one numbered segment per clock run
+        segment = request.form.get('segment', '').strip()
+        segment = int(segment) - 1 if segment else None
+    except ValueError:
+        return render_template('results.html', 
+                             analysis_html='<p>Please provide a numeric center/radius or start/end time.</p>',
+                             analysis_type='Error',
+                             timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    
+    profiler = request_profiler()
+    try:
+        with profile_section(profiler, 'read_window'):
+            window_content = log_store.read_window(log_id, start, end, segment)
+    except FileNotFoundError:
+        # Evicted since the check above
+        return log_unavailable()
+    if not window_content:
+        return render_template('results.html', 
+                             analysis_html=f'<p>No log lines found between {start:.3f} s and {end:.3f} s.</p>',
+                             analysis_type='Error',
+                             timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    
+    log_type = job.get('log_type', 'WiFi')
+    filename = f'{job["filename"]} [{start:.3f}s - {end:.3f}s]'
+    logger.info(f'Re-analyzing {log_type} log {log_id} window {start:.3f}-{end:.3f}')
+    new_job_id = start_analysis_job(filename, window_content, log_type, log_id, profiler)
+    return render_template('processing.html', job_id=new_job_id, filename=filename)
+
+def log_unavailable():
+    return render_template('results.html', 
+                         analysis_html='<p>Original log is no longer available. Please upload it again.</p>',
+                         analysis_type='Error',
+                         timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+# Clock segments of a stored log, or None when it was never stored or has been evicted
+def stored_time_ranges(log_id):
+    if not log_id:
+        return None
+    try:
+        return log_store.time_ranges(log_id)
+    except FileNotFoundError:
+        return None
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -0,0 +1,309 @@
+"""
+Timestamp-indexed storage for uploaded log files
+Logs are written to disk once and sliced by time window through mmap
+"""
+
+import bisect
+import heapq
+import mmap
+import os
+import re
+import threading
+import uuid
+
+# dmesg style "[ 1234.567890]" (uptime) and time-of-day "12:34:56.789" (btmon, hcidump, logcat)
+# Aligned times written by merge_timelines can be negative after a clock offset
+DMESG_TS_RE = re.compile(rb'^\s*<?\d*>?\[\s*(-?\d+\.\d+)\]')
+CLOCK_TS_RE = re.compile(rb'(?:^|\s)(\d{1,2}):(\d{2}):(\d{2}(?:\.\d+)?)(?=\s|$)')
+
+# One index entry per stride of bytes keeps the index small for multi-hour logs
+INDEX_STRIDE = 4096
+
+# Lines checked to tell which clock a log's timestamps use
+DOMAIN_SAMPLE_LINES = 200
+
+# Stored logs are evicted least recently used first once they exceed this size
+MAX_STORE_BYTES = 256 * 1024 * 1024
+
+
+def parse_timestamp(line):
+    """Return the timestamp of a log line in seconds, or None"""
+    match = DMESG_TS_RE.match(line)
+    if match:
+        return float(match.group(1))
+    match = CLOCK_TS_RE.search(line[:128])
+    if match:
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    return None
+
+
+class LogStore:
+    """Stores uploaded logs on disk with a sparse timestamp -> byte offset index
+
+    Indexes are cached in memory and rebuilt from the file after a restart.
+    """
+
+    def __init__(self, root, max_bytes=MAX_STORE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.indexes = {}
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, log_id):
+        return os.path.join(self.root, f'{log_id}.log')
+
+    def save(self, data):
+        """Write raw log bytes to disk, index them and return the log id"""
+        log_id = str(uuid.uuid4())
+        with open(self.path(log_id), 'wb') as f:
+            f.write(data)
+        index = build_index(data)
+        with self.lock:
+            self.indexes[log_id] = index
+        self.evict(keep=log_id)
+        return log_id
+
+    def has(self, log_id):
+        return os.path.exists(self.path(log_id))
+
+    def index(self, log_id):
+        """Return the cached index of a log, rebuilding it from disk on a miss"""
+        with self.lock:
+            index = self.indexes.get(log_id)
+        if index is not None:
+            return index
+        with open(self.path(log_id), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                index = []
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    index = build_index(mm)
+        with self.lock:
+            self.indexes[log_id] = index
+        return index
+
+    def time_ranges(self, log_id):
+        """Return (first, last) timestamps of each clock segment of the log"""
+        return [(timestamps[0], last) for timestamps, _, _, last in self.index(log_id)]
+
+    def read_window(self, log_id, start, end, segment=None):
+        """Return the decoded log lines with timestamps between start and end
+
+        A log whose clock resets (reboot, time of day crossing midnight) is
+        indexed as several segments. Matching lines of every segment are
+        returned in file order unless a segment number is given.
+        """
+        segments = self.index(log_id)
+        if segment is not None:
+            segments = segments[segment:segment + 1] if segment >= 0 else []
+        if end < start:
+            return ''
+
+        # Nearest index entries around the window; the file itself is never scanned
+        ranges = []
+        for timestamps, offsets, segment_end, last in segments:
+            if start > last or end < timestamps[0]:
+                continue
+            lo = bisect.bisect_left(timestamps, start) - 1
+            hi = bisect.bisect_right(timestamps, end)
+            begin = offsets[lo] if lo >= 0 else offsets[0]
+            stop = offsets[hi] if hi < len(offsets) else segment_end
+            ranges.append((begin, stop))
+        if not ranges:
+            return ''
+
+        path = self.path(log_id)
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                chunks = [mm[begin:stop] for begin, stop in ranges]
+        # Mark as recently used for eviction
+        os.utime(path)
+
+        lines = []
+        for chunk in chunks:
+            in_window = False
+            for line in chunk.splitlines(keepends=True):
+                ts = parse_timestamp(line)
+                if ts is not None:
+                    in_window = start <= ts <= end
+                # Untimestamped continuation lines follow the line they belong to
+                if in_window:
+                    lines.append(line)
+        return b''.join(lines).decode('utf-8', errors='ignore')
+
+    def delete(self, log_id):
+        with self.lock:
+            self.indexes.pop(log_id, None)
+        try:
+            os.remove(self.path(log_id))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, keep=None):
+        """Delete least recently used logs until the store fits in max_bytes"""
+        logs = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.log'):
+                stat = entry.stat()
+                logs.append((stat.st_mtime, stat.st_size, entry.name[:-len('.log')]))
+        total = sum(size for _, size, _ in logs)
+        for _, size, log_id in sorted(logs):
+            if total <= self.max_bytes:
+                break
+            if log_id == keep:
+                continue
+            self.delete(log_id)
+            total -= size
+
+
+def build_index(data):
+    """Build one sparse index segment per run of non-decreasing timestamps
+
+    Each segment is (timestamps, offsets, end offset, last timestamp). Every
+    line is parsed so clock resets start a new segment at the exact line;
+    within a segment one line per stride is sampled.
+    """
+    segments = []
+    timestamps = offsets = None
+    last = None
+    next_sample = 0
+    pos = 0
+    size = len(data)
+    while pos < size:
+        newline = data.find(b'\n', pos)
+        line_end = size if newline == -1 else newline + 1
+        ts = parse_timestamp(data[pos:line_end])
+        if ts is not None:
+            if last is None or ts < last:
+                if timestamps:
+                    segments.append((timestamps, offsets, pos, last))
+                timestamps, offsets = [], []
+                next_sample = pos
+            if pos >= next_sample:
+                timestamps.append(ts)
+                offsets.append(pos)
+                next_sample = pos + INDEX_STRIDE
+            last = ts
+        pos = line_end
+    if timestamps:
+        segments.append((timestamps, offsets, size, last))
+    return segments
+
+
+def timestamp_domain(data):
+    """Return 'uptime' for dmesg style, 'clock' for time-of-day logs, or None"""
+    for line in data.splitlines()[:DOMAIN_SAMPLE_LINES]:
+        if DMESG_TS_RE.match(line):
+            return 'uptime'
+        if CLOCK_TS_RE.search(line[:128]):
+            return 'clock'
+    return None
+
+
+def merge_timelines(sources, offsets=None):
+    """Merge (name, bytes) logs into one list of entries ordered by aligned timestamp
+
+    offsets are seconds added to each source's timestamps to line up clocks.
+    Sources on different clocks (dmesg uptime vs time of day) raise ValueError
+    unless offsets are given. Sources are identified by position, so uploads
+    sharing a name stay distinct. Entries a different source already emitted
+    are dropped; repeats within one source are kept.
+
+    Returns (aligned time, source index, bytes) entries: timestamped entries
+    are prefixed with their aligned time and every line with its source name.
+    Join them with render_timeline, optionally after fit_budget.
+    """
+    offsets = offsets or [0.0] * len(sources)
+    if len(offsets) != len(sources):
+        raise ValueError(f'Expected {len(sources)} clock offsets, got {len(offsets)}')
+    domains = {domain for domain in (timestamp_domain(data) for _, data in sources) if domain}
+    if len(domains) > 1 and not any(offsets):
+        raise ValueError('Logs use different clocks (dmesg uptime and time of day); '
+                         'provide per-file offsets in seconds to align them')
+
+    prefixes = [name.encode('utf-8', errors='ignore') + b'| ' for name, _ in sources]
+    streams = [timeline_entries(source, data, offset)
+               for source, ((_, data), offset) in enumerate(zip(sources, offsets))]
+    emitted = {}
+    entries = []
+    for key, _, source, entry in heapq.merge(*streams):
+        if emitted.setdefault(entry, source) != source:
+            continue
+        lines = [prefixes[source] + line for line in entry.splitlines(keepends=True)]
+        if key != float('-inf'):
+            lines[0] = f'[{key:12.6f}] '.encode() + lines[0]
+        entries.append((key, source, b''.join(lines)))
+    return entries
+
+
+def render_timeline(entries):
+    return b''.join(entry for _, _, entry in entries)
+
+
+def fit_budget(entries, budget):
+    """Cut merged (key, source, bytes) entries to budget bytes without starving a source
+
+    When over budget, entries are first limited to the time span where all
+    sources overlap. Each source then gets an equal share (unused shares are
+    redistributed) filled with its latest entries.
+    """
+    if sum(len(entry) for _, _, entry in entries) <= budget:
+        return entries
+
+    spans = {}
+    for key, source, _ in entries:
+        if key != float('-inf'):
+            first, last = spans.get(source, (key, key))
+            spans[source] = (min(first, key), max(last, key))
+    if len(spans) > 1:
+        overlap_start = max(first for first, _ in spans.values())
+        overlap_end = min(last for _, last in spans.values())
+        overlap = [e for e in entries if overlap_start <= e[0] <= overlap_end]
+        if {source for _, source, _ in overlap} == set(spans):
+            entries = overlap
+
+    sizes = {}
+    for _, source, entry in entries:
+        sizes[source] = sizes.get(source, 0) + len(entry)
+    shares = {}
+    remaining = budget
+    pending = sorted(sizes, key=sizes.get)
+    while pending:
+        share = remaining // len(pending)
+        source = pending.pop(0)
+        shares[source] = min(sizes[source], share)
+        remaining -= shares[source]
+
+    kept = []
+    for key, source, entry in reversed(entries):
+        if len(entry) <= shares[source]:
+            shares[source] -= len(entry)
+            kept.append((key, source, entry))
+        else:
+            shares[source] = 0
+    kept.reverse()
+    return kept
+
+
+def timeline_entries(source, data, offset=0.0):
+    """Group lines into timestamped entries sorted by (aligned timestamp, position)
+
+    Untimestamped lines stay with the entry they follow. The running maximum is
+    used as sort key so a clock jumping back keeps the original order.
+    """
+    entries = []
+    current = []
+    key = float('-inf')
+    for line in data.splitlines(keepends=True):
+        ts = parse_timestamp(line)
+        if ts is not None and current:
+            entries.append((key, len(entries), source, b''.join(current).rstrip() + b'\n'))
+            current = []
+        if ts is not None:
+            key = max(key, ts + offset)
+        current.append(line)
+    if current:
+        entries.append((key, len(entries), source, b''.join(current).rstrip() + b'\n'))
+    return [entry for entry in entries if entry[3].strip()]
@@ -143,8 +143,6 @@ def get_table_data(driver):
     print(test_logs)
     output = test.test_chat_completion_api(test_logs)
     print(output)
-    with open(f"response.md", 'w') as f:
-        f.write(output)
     
 
     time.sleep(5)
@@ -164,7 +162,7 @@ def run_analysis(url):
 
     # Login to the website
     login(driver, url)
-    get_table_data(driver)
+    return get_table_data(driver)
 
 
 
@@ -183,6 +181,8 @@ if __name__ == "__main__":
 
     # Login to the website
     login(driver, url)
-    get_table_data(driver)
+    output = get_table_data(driver)
 
-    
\ No newline at end of file
+    # Save the response when run as a script
+    with open("response.md", 'w', encoding='utf-8') as f:
+        f.write(output)
@@ -0,0 +1,170 @@
+"""
+Opt-in per-job profiling with cProfile and tracemalloc
+Enabled for admins by request header or for all jobs by environment flag
+"""
+
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# WIFI_LOGS_PROFILING=1 profiles every job; otherwise admins send "X-Profile: 1"
+PROFILING_ENV = 'WIFI_LOGS_PROFILING'
+ADMIN_TOKEN_ENV = 'WIFI_LOGS_ADMIN_TOKEN'
+PROFILE_HEADER = 'X-Profile'
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+PROFILE_FILE = 'profile.prof'
+REPORT_FILE = 'report.txt'
+
+logger = logging.getLogger(__name__)
+
+# tracemalloc is process wide, so it runs while any profiled job is active
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+
+def is_admin(request):
+    token = os.environ.get(ADMIN_TOKEN_ENV, '')
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get(ADMIN_TOKEN_HEADER, ''), token)
+
+
+def profiling_requested(request):
+    """Return True when the job started by this request should be profiled"""
+    if os.environ.get(PROFILING_ENV, '').lower() in ('1', 'true', 'yes'):
+        return True
+    return request.headers.get(PROFILE_HEADER, '') == '1' and is_admin(request)
+
+
+def profile_section(profiler, name):
+    """Profile a block when a profiler is attached to the job, otherwise do nothing"""
+    return profiler.section(name) if profiler else nullcontext()
+
+
+def _start_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        # Leave tracing on if something else (e.g. PYTHONTRACEMALLOC) started it
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+class JobProfiler:
+    """Collects a cProfile run, section timings and a tracemalloc snapshot for one job
+
+    Profiling never fails the job: if it cannot start (e.g. another profiler
+    is active on Python 3.12+) the job runs unprofiled and nothing is saved.
+    """
+
+    def __init__(self, job_id, root):
+        self.job_id = job_id
+        self.dir = os.path.join(root, job_id)
+        self.profile = cProfile.Profile()
+        self.sections = []
+        self.snapshot = None
+        self.depth = 0
+        self.active = False
+        self.failed = False
+
+    def _start(self):
+        _start_tracing()
+        try:
+            self.profile.enable()
+        except Exception:
+            _stop_tracing()
+            raise
+        self.active = True
+
+    def _stop(self):
+        try:
+            self.profile.disable()
+            self.snapshot = tracemalloc.take_snapshot()
+        finally:
+            self.active = False
+            _stop_tracing()
+
+    @contextmanager
+    def section(self, name):
+        # cProfile runs once around the outermost section; inner ones are timed
+        outer = self.depth == 0
+        if outer and not self.failed:
+            try:
+                self._start()
+            except Exception as e:
+                logger.warning(f'Profiling disabled for job {self.job_id}: {str(e)}')
+                self.failed = True
+        if not self.active:
+            yield
+            return
+
+        self.depth += 1
+        started = time.perf_counter()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            try:
+                elapsed = time.perf_counter() - started
+                memory_after, memory_peak = tracemalloc.get_traced_memory()
+                self.sections.append((self.depth - 1, name, elapsed, memory_after - memory_before, memory_peak))
+            finally:
+                self.depth -= 1
+                if outer:
+                    try:
+                        self._stop()
+                    except Exception as e:
+                        logger.warning(f'Could not stop profiling for job {self.job_id}: {str(e)}')
+                        self.failed = True
+
+    def save(self):
+        """Write the binary profile and a text report to the job's profile directory
+
+        Returns the directory, or None when profiling did not run.
+        """
+        if self.failed or not self.sections:
+            return None
+        os.makedirs(self.dir, exist_ok=True)
+        self.profile.dump_stats(os.path.join(self.dir, PROFILE_FILE))
+
+        report = io.StringIO()
+        report.write(f'Profile for job {self.job_id}\n\nSections (completion order):\n')
+        for depth, name, elapsed, memory_delta, memory_peak in self.sections:
+            report.write(f'{"  " * depth}{name}: {elapsed:.3f} s, '
+                         f'allocated {memory_delta / 1024:.1f} KiB, peak traced {memory_peak / 1024:.1f} KiB\n')
+
+        report.write('\nTop functions by cumulative time:\n')
+        stats = pstats.Stats(self.profile, stream=report)
+        stats.sort_stats('cumulative').print_stats(40)
+
+        if self.snapshot:
+            report.write('\nTop allocations still held at the end of the job:\n')
+            snapshot = self.snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ])
+            for stat in snapshot.statistics('lineno')[:25]:
+                report.write(f'{stat}\n')
+
+        with open(os.path.join(self.dir, REPORT_FILE), 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
+        return self.dir
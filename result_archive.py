@@ -0,0 +1,158 @@
+"""
+Compressed on-disk archive of analysis results
+Markdown is stored gzip-compressed in SQLite, HTML is rendered lazily on view
+"""
+
+import gzip
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+import markdown
+
+# Rendered HTML kept in memory, least recently viewed evicted first
+HTML_CACHE_SIZE = 32
+
+# History searches matching these are looked up by job id or content hash prefix
+JOB_ID_RE = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+HASH_PREFIX_RE = re.compile(r'[0-9a-fA-F]{8,64}')
+
+
+class ResultArchive:
+    """Stores analysis Markdown indexed by job id, content hash, log type and time"""
+
+    def __init__(self, path, html_cache_size=HTML_CACHE_SIZE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.html_cache = OrderedDict()
+        self.html_cache_size = html_cache_size
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.connect() as db:
+            db.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                content_hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL)''')
+            db.execute('''CREATE TABLE IF NOT EXISTS results (
+                job_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                log_type TEXT NOT NULL,
+                filename TEXT,
+                created TEXT NOT NULL,
+                log_id TEXT)''')
+            # Archives created before log ids were stored
+            columns = [row[1] for row in db.execute('PRAGMA table_info(results)')]
+            if 'log_id' not in columns:
+                db.execute('ALTER TABLE results ADD COLUMN log_id TEXT')
+            db.execute('CREATE INDEX IF NOT EXISTS results_created ON results (created)')
+            db.execute('CREATE INDEX IF NOT EXISTS results_log_type ON results (log_type, created)')
+            db.execute('CREATE INDEX IF NOT EXISTS results_content_hash ON results (content_hash)')
+
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def save(self, job_id, markdown_content, log_type, filename=None, log_id=None):
+        """Archive the Markdown of a finished analysis and return its content hash
+
+        log_id links the result to its stored log (see LogStore) across restarts.
+        """
+        data = markdown_content.encode('utf-8')
+        content_hash = hashlib.sha256(data).hexdigest()
+        created = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.lock, self.connect() as db:
+            # Identical results share one compressed blob
+            db.execute('INSERT OR IGNORE INTO blobs (content_hash, data) VALUES (?, ?)',
+                       (content_hash, gzip.compress(data)))
+            db.execute('INSERT OR REPLACE INTO results (job_id, content_hash, log_type, filename, created, log_id) '
+                       'VALUES (?, ?, ?, ?, ?, ?)',
+                       (job_id, content_hash, log_type, filename, created, log_id))
+        return content_hash
+
+    def get(self, job_id):
+        """Return the result metadata for a job, or None"""
+        with self.connect() as db:
+            row = db.execute('SELECT job_id, content_hash, log_type, filename, created, log_id '
+                             'FROM results WHERE job_id = ?', (job_id,)).fetchone()
+        return row_to_dict(row) if row else None
+
+    def get_markdown(self, job_id):
+        with self.connect() as db:
+            row = db.execute('SELECT b.data FROM results r JOIN blobs b ON b.content_hash = r.content_hash '
+                             'WHERE r.job_id = ?', (job_id,)).fetchone()
+        return gzip.decompress(row[0]).decode('utf-8') if row else None
+
+    def get_html(self, job_id):
+        """Return rendered HTML for a job, rendering and caching it on first view"""
+        result = self.get(job_id)
+        if not result:
+            return None
+        content_hash = result['content_hash']
+        with self.lock:
+            if content_hash in self.html_cache:
+                self.html_cache.move_to_end(content_hash)
+                return self.html_cache[content_hash]
+
+        html_content = markdown.markdown(self.get_markdown(job_id), extensions=['tables', 'fenced_code'])
+
+        with self.lock:
+            self.html_cache[content_hash] = html_content
+            if len(self.html_cache) > self.html_cache_size:
+                self.html_cache.popitem(last=False)
+        return html_content
+
+    def history(self, page=1, per_page=20, log_type=None, query=None):
+        """Return one page of result metadata, newest first, without loading content"""
+        conditions = []
+        params = []
+        if log_type:
+            conditions.append('log_type = ?')
+            params.append(log_type)
+        # Job ids and hash prefixes use their indexes; other text searches filenames
+        if query and JOB_ID_RE.fullmatch(query):
+            conditions.append('job_id = ?')
+            params.append(query.lower())
+        elif query and HASH_PREFIX_RE.fullmatch(query):
+            conditions.append('content_hash >= ? AND content_hash < ?')
+            params.extend([query.lower(), query.lower() + '\U0010ffff'])
+        elif query:
+            conditions.append("filename LIKE ? ESCAPE '\\'")
+            params.append(f'%{escape_like(query)}%')
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+        with self.connect() as db:
+            total = db.execute(f'SELECT COUNT(*) FROM results {where}', params).fetchone()[0]
+            rows = db.execute(f'SELECT job_id, content_hash, log_type, filename, created, log_id FROM results {where} '
+                              'ORDER BY created DESC, rowid DESC LIMIT ? OFFSET ?',
+                              params + [per_page, (page - 1) * per_page]).fetchall()
+        return {
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "results": [row_to_dict(row) for row in rows]
+        }
+
+
+def escape_like(text):
+    """Escape LIKE wildcards so user input only matches literally"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def row_to_dict(row):
+    job_id, content_hash, log_type, filename, created, log_id = row
+    return {
+        "job_id": job_id,
+        "content_hash": content_hash,
+        "log_type": log_type,
+        "filename": filename,
+        "created": created,
+        "log_id": log_id
+    }